@@ -1,11 +1,17 @@
 import os
 import ast
+import hashlib
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langgraph.graph import StateGraph, START, END
 from langchain_core.messages import HumanMessage, SystemMessage
 from tools import fetch_onedrive_files
+from charts import chart_capabilities
+from api_client import invoke_llm, LRUCache
 
 # =============================
 # 環境変数読み込み
@@ -20,12 +26,14 @@ class AgentState(BaseModel):
     question: str = ""                               # ユーザーの質問
 
     quantity_files: list = Field(default_factory=list, description="量的データファイル一覧")
+    file_schemas: dict = Field(default_factory=dict, description="ファイルごとの列名・サンプル行（先頭のみ取得）")
     quantity_file_contents: dict = Field(default_factory=dict)
 
     quality_files: list = Field(default_factory=list, description="質的データファイル一覧")
     quality_file_contents: dict = Field(default_factory=dict)
 
     selected_files: list = Field(default_factory=list)  # ユーザーが選んだファイル
+    file_insights: dict = Field(default_factory=dict, description="ファイルごとの要約（map-reduce の map 結果）")
 
     answer: str = ""           # LLMの返答（ファイル選択）
     predict_answer: str = ""   # LLMの最終分析結果
@@ -38,26 +46,44 @@ class AgentState(BaseModel):
 llm = ChatGoogleGenerativeAI(
     model=os.getenv("GEMINI_MODEL"),
     temperature=0.5,
+    max_retries=0,  # リトライは api_client.invoke_llm に一本化
     transport="rest"
 )
 
 # =============================
 # ① ファイル選択ノード
 # =============================
+def describe_files(files: list, schemas: dict) -> str:
+    """ファイル名＋列名＋描画可能なグラフの一覧をプロンプト用に整形する"""
+    lines = []
+    for name in files:
+        schema = schemas.get(name)
+        if not schema or "columns" not in schema:
+            lines.append(f"- {name}")
+            continue
+        charts = [c for c, ok in chart_capabilities(schema["columns"]).items() if ok]
+        lines.append(
+            f"- {name}（列: {schema['columns']} / サンプル: {schema['sample_rows'][:2]} / "
+            f"描画可能グラフ: {charts or 'なし'}）"
+        )
+    return "\n".join(lines)
+
+
 def select_file_node(state: AgentState) -> AgentState:
     system_prompt = f"""
     あなたはデータ選定アシスタントです。
-    以下のファイル一覧から、ユーザーの依頼内容に関係のあるものだけを選んでください。
+    以下のファイル一覧（列名・サンプル行付き）から、ユーザーの依頼内容に関係のあるものだけを選んでください。
     
     ✅ 出力ルール：
     ・Python の list 形式のみで回答してください（例：['finance.csv', 'healthcare.csv']）
     ・文章やJSON形式は禁止です
 
-    選択可能ファイル：{state.quantity_files}
+    選択可能ファイル：
+{describe_files(state.quantity_files, state.file_schemas)}
     """
     messages = [SystemMessage(content=system_prompt),
                 HumanMessage(content=state.question)]
-    state.answer = llm.invoke(messages).content
+    state.answer = invoke_llm(llm, messages).content
     state.state = "file_selected"
     return state
 
@@ -87,7 +113,8 @@ def quantity_files_node(state: AgentState) -> AgentState:
 
     state.quantity_file_contents = fetch_onedrive_files(
         file_names=state.selected_files,
-        access_token=state.access_token
+        access_token=state.access_token,
+        schemas=state.file_schemas
     )
     state.state = "fetched_quantity_files"
     return state
@@ -111,6 +138,18 @@ def quality_files_node(state: AgentState) -> AgentState:
 # =============================
 # ④ 最終分析ノード
 # =============================
+OUTPUT_FORMAT = """
+    ✅ 出力フォーマット：
+    ### ✅ インサイト（事実・傾向）
+    -
+    ### 💡 仮説・示唆
+    -
+    ### ⚠ リスク・懸念点
+    -
+    ### 🚀 次のアクション提案
+    -
+"""
+
 def predict_node(state: AgentState) -> AgentState:
     system_prompt = f"""
     あなたはデータサイエンティストです。
@@ -121,20 +160,117 @@ def predict_node(state: AgentState) -> AgentState:
 
     --- 質的データ（任意）---
     {state.quality_file_contents}
+    {OUTPUT_FORMAT}
+    """
+    messages = [SystemMessage(content=system_prompt),
+                HumanMessage(content=state.question)]
+    state.predict_answer = invoke_llm(llm, messages).content
+    state.state = "predict_done"
+    return state
 
-    ✅ 出力フォーマット：
-    ### ✅ インサイト（事実・傾向）
-    -
-    ### 💡 仮説・示唆
-    -
-    ### ⚠ リスク・懸念点
-    -
-    ### 🚀 次のアクション提案
-    -
+# =============================
+# ④' map-reduce 分析（ファイル数が多い場合）
+# =============================
+MAP_REDUCE_MIN_FILES = int(os.getenv("MAP_REDUCE_MIN_FILES", "3"))  # この数以上で map-reduce
+MAP_MAX_WORKERS = int(os.getenv("MAP_MAX_WORKERS", "4"))            # map の同時実行数
+DIGEST_MAX_CHARS = 6000     # 1ファイルあたり LLM に渡すダイジェストの最大文字数
+DIGEST_HEAD_ROWS = 5        # ダイジェストに含める先頭行数
+DIGEST_TOP_VALUES = 5       # カテゴリ列ごとの上位値の数
+
+INSIGHT_CACHE_SIZE = 500   # ファイル要約キャッシュの最大件数
+
+_insight_cache = LRUCache(INSIGHT_CACHE_SIZE)  # (ファイル名, 区切り文字, 内容のハッシュ) -> ファイル要約
+
+
+def choose_analysis_mode(state: AgentState) -> str:
+    return "map_reduce" if len(state.quantity_file_contents) >= MAP_REDUCE_MIN_FILES else "single"
+
+
+def build_digest(content: str, delimiter: str = ",") -> str:
+    """
+    生データの代わりに LLM に渡す要約統計（行数・列型・describe・先頭行・上位値）
+    DataFrame にできない場合は先頭を切り詰めて返す
+    """
+    try:
+        df = pd.read_csv(StringIO(content), sep=delimiter)
+    except Exception:
+        return content[:DIGEST_MAX_CHARS]
+
+    parts = [
+        f"行数: {len(df)} / 列数: {len(df.columns)}",
+        f"列の型:\n{df.dtypes.to_string()}",
+        f"先頭{DIGEST_HEAD_ROWS}行:\n{df.head(DIGEST_HEAD_ROWS).to_string()}",
+    ]
+    numeric = df.select_dtypes("number")
+    if not numeric.empty:
+        parts.append(f"数値列の統計:\n{numeric.describe().to_string()}")
+    for col in df.select_dtypes(exclude="number").columns:
+        top = df[col].value_counts().head(DIGEST_TOP_VALUES)
+        parts.append(f"{col} の上位値:\n{top.to_string()}")
+
+    return "\n\n".join(parts)[:DIGEST_MAX_CHARS]
+
+
+def summarize_file(name: str, content: str, schema: dict = None) -> str:
+    """1ファイル分の要約を作成する（内容が同じなら再分析しない）"""
+    if not isinstance(content, str) or content.startswith("⚠"):
+        return content
+
+    delimiter = (schema or {}).get("delimiter", ",")
+    key = (name, delimiter, hashlib.sha256(content.encode("utf-8")).hexdigest())
+    cached = _insight_cache.get(key)
+    if cached is not None:
+        return cached
+
+    digest = build_digest(content, delimiter)
+    system_prompt = f"""
+    あなたはデータサイエンティストです。
+    以下は1ファイル分のデータの要約統計です。後で他ファイルと統合できるよう簡潔に要約してください。
+
+    ✅ 出力ルール：
+    ・列構成、主要な集計値（合計・平均・上位項目など）、目立つ傾向や外れ値を箇条書きで
+    ・10行以内
+
+    --- {name} ---
+    {digest}
+    """
+    insight = invoke_llm(llm, [SystemMessage(content=system_prompt)]).content
+    _insight_cache.set(key, insight)
+    return insight
+
+
+def map_files_node(state: AgentState) -> AgentState:
+    def summarize_or_warn(name):
+        # 1ファイルの失敗で全体を止めない（⚠ 付きで reduce に渡す）
+        try:
+            return summarize_file(name, state.quantity_file_contents[name], state.file_schemas.get(name))
+        except Exception as e:
+            return f"⚠ 要約失敗: {e}"
+
+    names = list(state.quantity_file_contents.keys())
+    with ThreadPoolExecutor(max_workers=MAP_MAX_WORKERS) as executor:
+        insights = executor.map(summarize_or_warn, names)
+        state.file_insights = dict(zip(names, insights))
+    state.state = "map_done"
+    return state
+
+
+def reduce_node(state: AgentState) -> AgentState:
+    insights = "\n\n".join(f"--- {name} ---\n{insight}" for name, insight in state.file_insights.items())
+    system_prompt = f"""
+    あなたはデータサイエンティストです。
+    以下はファイルごとの要約です。これらを統合して、定量的・定性的な分析を行い、洞察とアクションを出してください。
+
+    --- 量的データ（ファイル別要約）---
+    {insights}
+
+    --- 質的データ（任意）---
+    {state.quality_file_contents}
+    {OUTPUT_FORMAT}
     """
     messages = [SystemMessage(content=system_prompt),
                 HumanMessage(content=state.question)]
-    state.predict_answer = llm.invoke(messages).content
+    state.predict_answer = invoke_llm(llm, messages).content
     state.state = "predict_done"
     return state
 
@@ -155,6 +291,8 @@ graph.add_node("select_file_node", select_file_node)
 graph.add_node("quantity_files_node", quantity_files_node)
 graph.add_node("quality_files_node", quality_files_node)
 graph.add_node("predict_node", predict_node)
+graph.add_node("map_files_node", map_files_node)
+graph.add_node("reduce_node", reduce_node)
 graph.add_node("error_node", error_node)
 
 graph.add_edge(START, "select_file_node")
@@ -169,8 +307,19 @@ graph.add_conditional_edges(
 )
 
 graph.add_edge("quantity_files_node", "quality_files_node")
-graph.add_edge("quality_files_node", "predict_node")
+
+graph.add_conditional_edges(
+    "quality_files_node",
+    choose_analysis_mode,
+    {
+        "single": "predict_node",
+        "map_reduce": "map_files_node"
+    }
+)
+
+graph.add_edge("map_files_node", "reduce_node")
 graph.add_edge("predict_node", END)
+graph.add_edge("reduce_node", END)
 graph.add_edge("error_node", END)
 
 app = graph.compile()
\ No newline at end of file
@@ -0,0 +1,344 @@
+# api_client.py
+import os
+import time
+import random
+import hashlib
+import threading
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+import requests
+from google.api_core import exceptions as google_exceptions
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# =============================
+# 設定（環境変数で上書き可）
+# =============================
+GRAPH_RATE_PER_SEC = float(os.getenv("GRAPH_RATE_PER_SEC", "5"))
+GRAPH_BURST = int(os.getenv("GRAPH_BURST", "10"))
+DOWNLOAD_RATE_PER_SEC = float(os.getenv("DOWNLOAD_RATE_PER_SEC", "5"))
+DOWNLOAD_BURST = int(os.getenv("DOWNLOAD_BURST", "10"))
+GEMINI_RATE_PER_SEC = float(os.getenv("GEMINI_RATE_PER_SEC", "1"))
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", "3"))
+
+MAX_RETRIES = int(os.getenv("API_MAX_RETRIES", "4"))
+BACKOFF_BASE_SEC = 1.0
+BACKOFF_MAX_SEC = 60.0
+REQUEST_TIMEOUT_SEC = 60
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# =============================
+# トークンバケット（API単位のレート制限）
+# =============================
+class TokenBucket:
+    """rate 個/秒で補充され、最大 capacity 個まで貯まるトークンバケット"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Retry-After 受信時：バケット全体を一定時間停止する"""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+# =============================
+# サーキットブレーカー
+# =============================
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """連続失敗（5xx・接続エラー）が閾値を超えたら一定時間呼び出しを遮断する"""
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.half_open_in_flight = False
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at >= self.reset_timeout and not self.half_open_in_flight:
+                # half-open：1回だけ試行を許可し、結果が出るまで他の呼び出しは遮断
+                self.half_open_in_flight = True
+                return
+            raise CircuitOpenError(f"❌ {self.name} API が一時的に利用できません（しばらくしてから再試行してください）")
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.half_open_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.half_open_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.half_open_in_flight = False
+
+# =============================
+# シングルフライト（同一リクエストの合流）
+# =============================
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """同じ key の同時呼び出しは最初の1回だけ実行し、結果を共有する"""
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self.calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
+
+# =============================
+# 上限付きキャッシュ（セッション横断で共有するもの用）
+# =============================
+class LRUCache:
+    """最大 max_size 件まで保持し、古く使われていないものから捨てるキャッシュ"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.items:
+                return default
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+# =============================
+# API ごとのリミッター
+# =============================
+graph_bucket = TokenBucket(GRAPH_RATE_PER_SEC, GRAPH_BURST)
+download_bucket = TokenBucket(DOWNLOAD_RATE_PER_SEC, DOWNLOAD_BURST)
+gemini_bucket = TokenBucket(GEMINI_RATE_PER_SEC, GEMINI_BURST)
+
+graph_breaker = CircuitBreaker("OneDrive")
+download_breaker = CircuitBreaker("OneDrive ダウンロード")
+gemini_breaker = CircuitBreaker("Gemini")
+
+_http_flight = SingleFlight()
+_llm_flight = SingleFlight()
+
+
+def _backoff_seconds(attempt: int) -> float:
+    delay = min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * (2 ** attempt))
+    return delay * (0.5 + random.random() / 2)
+
+
+def _retry_after_seconds(response) -> float | None:
+    """Retry-After ヘッダー（秒数または日時）を BACKOFF_MAX_SEC を上限に秒数へ変換する"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(BACKOFF_MAX_SEC, max(0.0, seconds))
+
+# =============================
+# HTTP GET（Graph / ダウンロードURL 共通）
+# =============================
+def _read_body(response: requests.Response, max_bytes: int | None):
+    """本文を読み切る（max_bytes 指定時はその長さで打ち切って接続を閉じる）"""
+    if max_bytes is None:
+        response.content
+        return
+    body = bytearray()
+    for chunk in response.iter_content(chunk_size=min(max_bytes, 8192)):
+        body.extend(chunk)
+        if len(body) >= max_bytes:
+            break
+    response._content = bytes(body[:max_bytes])
+    response.close()
+
+
+def _get_with_retry(url: str, headers: dict, bucket: TokenBucket,
+                    breaker: CircuitBreaker, max_bytes: int | None = None) -> requests.Response:
+    response = None
+    for attempt in range(MAX_RETRIES + 1):
+        breaker.before_call()
+        bucket.acquire()
+        try:
+            response = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT_SEC,
+                                    stream=max_bytes is not None)
+            # 共有前に本文を読み切っておく（読み取り中の切断も接続エラーとして扱う）
+            _read_body(response, max_bytes)
+        except requests.RequestException:
+            breaker.record_failure()
+            if attempt == MAX_RETRIES:
+                raise
+            time.sleep(_backoff_seconds(attempt))
+            continue
+
+        if response.status_code not in RETRYABLE_STATUS:
+            breaker.record_success()
+            return response
+
+        if response.status_code == 429:
+            # スロットリングはサーバー稼働中の合図：ブレーカーには数えずペース調整のみ
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+        if attempt == MAX_RETRIES:
+            break
+        retry_after = _retry_after_seconds(response)
+        if retry_after is not None:
+            bucket.pause(retry_after)
+        else:
+            time.sleep(_backoff_seconds(attempt))
+    return response
+
+
+def http_get(url: str, headers: dict | None = None, api: str = "graph",
+             max_bytes: int | None = None) -> requests.Response:
+    """
+    レート制限・Retry-After 対応リトライ・サーキットブレーカー付きの GET
+    同一 URL / ヘッダーの同時リクエストは1回の通信にまとめる
+    api: "graph"（Graph API）または "download"（@microsoft.graph.downloadUrl）
+    max_bytes: 指定時はストリーミングで先頭 max_bytes だけ読む
+    """
+    headers = headers or {}
+    if api == "graph":
+        bucket, breaker = graph_bucket, graph_breaker
+    else:
+        bucket, breaker = download_bucket, download_breaker
+    key = (url, tuple(sorted(headers.items())), max_bytes)
+    return _http_flight.do(key, lambda: _get_with_retry(url, headers, bucket, breaker, max_bytes))
+
+# =============================
+# LLM 呼び出し（Gemini）
+# =============================
+GEMINI_QUOTA_ERRORS = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)
+GEMINI_UNAVAILABLE_ERRORS = (
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.GatewayTimeout,
+)
+
+
+def _status_code(e: Exception) -> int | None:
+    """例外（またはラップ元の例外）が持つ HTTP ステータスコードを返す"""
+    for err in (e, e.__cause__):
+        code = getattr(err, "code", None) or getattr(err, "status_code", None)
+        if isinstance(code, int):
+            return int(code)
+    return None
+
+
+def _is_quota_error(e: Exception) -> bool:
+    return isinstance(e, GEMINI_QUOTA_ERRORS) or _status_code(e) == 429
+
+
+def _is_unavailable_error(e: Exception) -> bool:
+    return isinstance(e, GEMINI_UNAVAILABLE_ERRORS) or _status_code(e) in (500, 502, 503, 504)
+
+
+def _invoke_with_retry(llm, messages):
+    for attempt in range(MAX_RETRIES + 1):
+        gemini_breaker.before_call()
+        gemini_bucket.acquire()
+        try:
+            result = llm.invoke(messages)
+        except Exception as e:
+            if _is_quota_error(e):
+                # クォータ超過はペース調整のみ（ブレーカーには数えない）
+                gemini_breaker.record_success()
+                if attempt == MAX_RETRIES:
+                    raise Exception(f"❌ Gemini API のクォータ上限に達しました: {e}") from e
+            elif _is_unavailable_error(e):
+                gemini_breaker.record_failure()
+                if attempt == MAX_RETRIES:
+                    raise Exception(f"❌ Gemini API が応答しません: {e}") from e
+            else:
+                gemini_breaker.record_success()
+                raise
+            gemini_bucket.pause(_backoff_seconds(attempt))
+            continue
+        gemini_breaker.record_success()
+        return result
+
+
+def invoke_llm(llm, messages):
+    """レート制限・リトライ付きの llm.invoke（同一プロンプトの同時呼び出しは合流）"""
+    digest = hashlib.sha256()
+    for m in messages:
+        digest.update(type(m).__name__.encode())
+        digest.update(str(m.content).encode("utf-8"))
+    return _llm_flight.do(digest.hexdigest(), lambda: _invoke_with_retry(llm, messages))
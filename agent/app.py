@@ -3,11 +3,12 @@ import msal
 import os
 from dotenv import load_dotenv
 from tools import (
-    get_file_list,
-    fetch_onedrive_files,
-    convert_to_dataframes,
-    visualization_subplots
+    list_folder_items,
+    get_file_schemas,
+    convert_to_dataframes
 )
+from charts import visualization_charts
+from preview import render_dataframe_preview, clear_preview_cache
 from agent import AgentState, app as langgraph_app
 
 # ✅ .env 読み込み
@@ -49,10 +50,17 @@ if "access_token" not in st.session_state:
 
 # -------------------- 初回のみ：State初期化 --------------------
 if st.session_state.get("is_first_run", False):
-    quantity_files = get_file_list(st.session_state.access_token)
+    try:
+        items = list_folder_items(st.session_state.access_token)
+        quantity_files = [item["name"] for item in items]
+        file_schemas = get_file_schemas(items)
+    except Exception as e:
+        st.error(str(e))
+        st.stop()
     st.session_state.agent_state = AgentState(
         state="",
         quantity_files=quantity_files,
+        file_schemas=file_schemas,
         quantity_file_contents={},
         quality_files=[],
         quality_file_contents={},
@@ -64,7 +72,7 @@ if st.session_state.get("is_first_run", False):
     )
     st.session_state.messages = []
     st.session_state.dfs = None
-    st.session_state.fig = None
+    st.session_state.charts = None
     st.session_state.is_first_run = False
 
 col1, col2 = st.columns(2)
@@ -86,33 +94,51 @@ with col2:
         state_dict = st.session_state.agent_state.dict()
         state_dict["question"] = user_input
 
-        result = langgraph_app.invoke(state_dict)
-        st.session_state.agent_state = AgentState(**result)
+        try:
+            result = langgraph_app.invoke(state_dict)
+        except Exception as e:
+            # ✅ レート制限・サーキットブレーカー等のエラーは画面に表示して終了
+            result = None
+            st.error(str(e))
+
+        if result is not None:
+            st.session_state.agent_state = AgentState(**result)
 
-        reply = result.get("predict_answer") or result.get("answer") or "⚠ 応答なし"
-        st.session_state.messages.append({"role": "assistant", "content": reply})
+            reply = result.get("predict_answer") or result.get("answer") or "⚠ 応答なし"
+            st.session_state.messages.append({"role": "assistant", "content": reply})
 
-        # ✅ ここで 📊 データ取得 ＆ グラフ作成
-        if result.get("selected_files"):
-            raw_csvs = fetch_onedrive_files(
-                file_names=result["selected_files"],
-                access_token=result["access_token"]
-            )
-            st.session_state.dfs = convert_to_dataframes(raw_csvs)
-            st.session_state.fig = visualization_subplots(st.session_state.dfs)
+            # ✅ ここで 📊 グラフ作成（LangGraph で取得済みの内容を再利用）
+            if result.get("selected_files") and result.get("quantity_file_contents"):
+                st.session_state.dfs = convert_to_dataframes(
+                    result["quantity_file_contents"], result.get("file_schemas")
+                )
+                clear_preview_cache()
+                st.session_state.charts = visualization_charts(st.session_state.dfs)
 
-        with st.chat_message("assistant"):
-            st.write(reply)
+            with st.chat_message("assistant"):
+                st.write(reply)
 
 # -------------------- 左：データ可視化 --------------------
 with col1:
     st.subheader("📊 データの可視化")
 
-    if st.session_state.fig:
-        st.pyplot(st.session_state.fig)
+    if st.session_state.charts:
+        for name, charts in st.session_state.charts.items():
+            st.write(f"### {name}")
+            if isinstance(charts, str):
+                st.error(charts)
+                continue
+            for chart in charts:
+                if isinstance(chart, str):
+                    st.warning(chart)
+                else:
+                    st.altair_chart(chart, use_container_width=True)
 
     if st.session_state.dfs:
         st.subheader("📄 DataFrame 一覧")
         for name, df in st.session_state.dfs.items():
             st.write(f"### {name}")
-            st.dataframe(df)
\ No newline at end of file
+            if isinstance(df, str):
+                st.error(df)
+                continue
+            render_dataframe_preview(name, df)
\ No newline at end of file
@@ -0,0 +1,237 @@
+# charts.py
+import numpy as np
+import pandas as pd
+import altair as alt
+
+# =============================
+# 設定
+# =============================
+HIST_BINS = 30          # ヒストグラムのビン数
+PIE_TOP_K = 10          # 円グラフに個別表示する上位カテゴリ数
+MAX_POINTS = 1000       # 時系列で描画する最大点数（LTTB）
+DATE_PARSE_MIN_RATIO = 0.9  # 日付列とみなす日時変換成功率
+DATE_SAMPLE_ROWS = 1000     # 日付判定に使う行数
+OTHER_LABEL = "その他"
+
+# チャートごとに必要な列
+CHART_REQUIREMENTS = {
+    "セクター別含み損益": {"sector", "unrealized_profit"},
+    "資産クラス比率": {"asset_class", "quantity", "price_per_unit"},
+    "数量分布": {"quantity"},
+}
+
+# =============================
+# 描画可否チェック（列名だけで判定）
+# =============================
+def chart_capabilities(columns) -> dict:
+    """列名一覧から、各チャートが描画可能かどうかを返す"""
+    columns = set(columns)
+    return {chart: required <= columns for chart, required in CHART_REQUIREMENTS.items()}
+
+# =============================
+# サーバー側での集約（NumPy）
+# =============================
+def histogram_bins(values, bins: int = HIST_BINS) -> pd.DataFrame:
+    """数値列を np.histogram でビン集計し、ビンごとの件数だけを返す"""
+    arr = pd.to_numeric(pd.Series(values), errors="coerce").to_numpy(dtype=float)
+    arr = arr[np.isfinite(arr)]
+    if arr.size == 0:
+        return pd.DataFrame(columns=["bin_start", "bin_end", "count"])
+
+    counts, edges = np.histogram(arr, bins=bins)
+    return pd.DataFrame({"bin_start": edges[:-1], "bin_end": edges[1:], "count": counts})
+
+
+def top_k_with_other(grouped: pd.Series, k: int = PIE_TOP_K) -> pd.DataFrame:
+    """
+    集計済み Series の上位 k 件を残し、残りを「その他」にまとめる
+    円グラフ用のため 0 以下の値は除外する
+    """
+    grouped = grouped.dropna()
+    grouped = grouped[grouped > 0]
+    if len(grouped) <= k:
+        top = grouped
+        rest = 0.0
+    else:
+        values = grouped.to_numpy(dtype=float)
+        order = np.argpartition(-values, k - 1)[:k]
+        top = grouped.iloc[order]
+        rest = values.sum() - values[order].sum()
+
+    result = pd.DataFrame({"label": top.index.astype(str), "value": top.to_numpy(dtype=float)})
+    result = result.sort_values("value", ascending=False)
+    if rest > 0:
+        result = pd.concat([result, pd.DataFrame({"label": [OTHER_LABEL], "value": [rest]})])
+    return result.reset_index(drop=True)
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int = MAX_POINTS) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets で残す点のインデックスを返す
+    x は昇順に並んでいること
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_lo, next_hi = edges[i + 1], edges[i + 2]
+            avg_x = x[next_lo:next_hi].mean()
+            avg_y = y[next_lo:next_hi].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+
+        area = np.abs(
+            (x[a] - avg_x) * (y[lo:hi] - y[a])
+            - (x[a] - x[lo:hi]) * (avg_y - y[a])
+        )
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+
+    return selected
+
+
+def downsample_timeseries(dates, values, threshold: int = MAX_POINTS) -> pd.DataFrame:
+    """日付ごとに合計した上で LTTB で threshold 点まで間引く"""
+    series = pd.Series(
+        pd.to_numeric(pd.Series(values), errors="coerce").to_numpy(),
+        index=pd.to_datetime(pd.Series(dates), errors="coerce").dt.normalize().to_numpy(),
+    )
+    series = series[series.index.notna()].dropna()
+    daily = series.groupby(level=0).sum().sort_index()
+    if daily.empty:
+        return pd.DataFrame(columns=["date", "value"])
+
+    x = daily.index.asi8.astype(float)
+    y = daily.to_numpy(dtype=float)
+    idx = lttb_indices(x, y, threshold)
+    return pd.DataFrame({"date": daily.index[idx], "value": y[idx]})
+
+
+def _find_date_column(df: pd.DataFrame):
+    """
+    列名に date / time を含み、実際に日時として読める列を返す
+    数値列（holding_time_days など）は対象外
+    """
+    for col in df.columns:
+        name = str(col).lower()
+        if "date" not in name and "time" not in name:
+            continue
+        values = df[col]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            return col
+        if pd.api.types.is_numeric_dtype(values):
+            continue
+        sample = values.dropna().head(DATE_SAMPLE_ROWS)
+        if len(sample) and pd.to_datetime(sample, errors="coerce").notna().mean() >= DATE_PARSE_MIN_RATIO:
+            return col
+    return None
+
+# =============================
+# Altair（クライアント側描画）
+# =============================
+def build_charts(df: pd.DataFrame, file: str) -> list:
+    """
+    1ファイル分のチャートを作成する（集約済みの配列だけを Vega-Lite に渡す）
+    描画できないチャートはエラーメッセージ文字列として返す
+    """
+    charts = []
+    capabilities = chart_capabilities(df.columns)
+
+    # ✅ (1) セクター別含み損益
+    if not capabilities["セクター別含み損益"]:
+        charts.append("棒グラフ描画不可（必要な列がありません）")
+    else:
+        try:
+            sector_profit = df.groupby("sector")["unrealized_profit"].sum().reset_index()
+            charts.append(
+                alt.Chart(sector_profit, title=f"{file}：セクター別含み損益")
+                .mark_bar()
+                .encode(
+                    x=alt.X("sector:N", title="Sector", sort="-y"),
+                    y=alt.Y("unrealized_profit:Q", title="Unrealized Profit"),
+                    tooltip=["sector", "unrealized_profit"],
+                )
+            )
+        except Exception:
+            charts.append("棒グラフ描画不可")
+
+    # ✅ (2) 資産クラス別 保有評価額の円グラフ（上位K件＋その他）
+    if not capabilities["資産クラス比率"]:
+        charts.append("円グラフ描画不可（必要な列がありません）")
+    else:
+        try:
+            eval_value = df["quantity"] * df["price_per_unit"]
+            asset_value = top_k_with_other(eval_value.groupby(df["asset_class"]).sum())
+            charts.append(
+                alt.Chart(asset_value, title=f"{file}：資産クラス比率")
+                .mark_arc()
+                .encode(
+                    theta=alt.Theta("value:Q"),
+                    color=alt.Color("label:N", title="Asset Class", sort=None),
+                    tooltip=["label", "value"],
+                )
+            )
+        except Exception:
+            charts.append("円グラフ描画不可")
+
+    # ✅ (3) 取引数量ヒストグラム（ビン集計済み）
+    if not capabilities["数量分布"]:
+        charts.append("ヒストグラム描画不可（必要な列がありません）")
+    else:
+        try:
+            hist = histogram_bins(df["quantity"])
+            charts.append(
+                alt.Chart(hist, title=f"{file}：数量分布（ヒストグラム）")
+                .mark_bar()
+                .encode(
+                    x=alt.X("bin_start:Q", title="Quantity", bin="binned"),
+                    x2="bin_end:Q",
+                    y=alt.Y("count:Q", title="Count"),
+                    tooltip=["bin_start", "bin_end", "count"],
+                )
+            )
+        except Exception:
+            charts.append("ヒストグラム描画不可")
+
+    # ✅ (4) 時系列（日付列がある場合のみ・LTTBで間引き）
+    date_col = _find_date_column(df)
+    if date_col is not None and "unrealized_profit" in df.columns:
+        try:
+            ts = downsample_timeseries(df[date_col], df["unrealized_profit"])
+            charts.append(
+                alt.Chart(ts, title=f"{file}：含み損益の推移")
+                .mark_line()
+                .encode(
+                    x=alt.X("date:T", title=str(date_col)),
+                    y=alt.Y("value:Q", title="Unrealized Profit"),
+                    tooltip=["date", "value"],
+                )
+                .interactive()
+            )
+        except Exception:
+            charts.append("時系列グラフ描画不可")
+
+    return charts
+
+
+def visualization_charts(dataframes: dict) -> dict:
+    """
+    各DataFrameごとのチャート一覧を返す
+    {ファイル名: [alt.Chart | エラー文字列, ...]} / DataFrame変換失敗時は文字列
+    """
+    result = {}
+    for file, df in dataframes.items():
+        if isinstance(df, str):
+            result[file] = df
+            continue
+        result[file] = build_charts(df, file)
+    return result
@@ -0,0 +1,114 @@
+# preview.py
+import math
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# =============================
+# 設定
+# =============================
+PAGE_SIZE = 100
+NO_SELECTION = "（なし）"
+CACHE_KEY = "preview_cache"
+
+# =============================
+# サーバー側のソート・フィルタ（セッション内キャッシュ）
+# =============================
+def _cache() -> dict:
+    if CACHE_KEY not in st.session_state:
+        st.session_state[CACHE_KEY] = {}
+    return st.session_state[CACHE_KEY]
+
+
+def clear_preview_cache():
+    """DataFrame を差し替えたときに呼ぶ（古いソートインデックスを破棄）"""
+    st.session_state.pop(CACHE_KEY, None)
+
+
+def _sort_index(name: str, df: pd.DataFrame, column, ascending: bool) -> np.ndarray:
+    """列ごとのソート順（行位置の配列）を1回だけ計算してキャッシュする"""
+    key = ("sort", name, column, ascending)
+    cache = _cache()
+    if key not in cache:
+        values = df[column].reset_index(drop=True)
+        try:
+            ordered = values.sort_values(ascending=ascending, kind="stable", na_position="last")
+        except TypeError:
+            # 型が混在した object 列（str と int など）は文字列として並べる
+            ordered = values.sort_values(
+                ascending=ascending, kind="stable", na_position="last",
+                key=lambda s: s.where(s.isna(), s.astype(str))
+            )
+        cache[key] = ordered.index.to_numpy()
+    return cache[key]
+
+
+def _filter_mask(name: str, df: pd.DataFrame, column, query: str) -> np.ndarray:
+    """部分一致フィルタの結果（bool配列）を、ファイル・列ごとに直近1件だけキャッシュする"""
+    key = ("filter", name, column)
+    cache = _cache()
+    cached = cache.get(key)
+    if cached is None or cached[0] != query:
+        mask = (
+            df[column].astype(str)
+            .str.contains(query, case=False, regex=False, na=False)
+            .to_numpy()
+        )
+        cache[key] = (query, mask)
+    return cache[key][1]
+
+
+def row_order(name: str, df: pd.DataFrame, sort_col=None, ascending=True,
+              filter_col=None, query: str = "") -> np.ndarray:
+    """表示対象の行位置を、ソート・フィルタ適用済みの順で返す"""
+    if sort_col is not None:
+        order = _sort_index(name, df, sort_col, ascending)
+    else:
+        order = np.arange(len(df))
+
+    if filter_col is not None and query:
+        mask = _filter_mask(name, df, filter_col, query)
+        order = order[mask[order]]
+    return order
+
+# =============================
+# ページング付きプレビュー
+# =============================
+def render_dataframe_preview(name: str, df: pd.DataFrame, page_size: int = PAGE_SIZE):
+    """
+    表示中のページ分だけをフロントエンドに送る DataFrame プレビュー
+    （st.dataframe は Arrow で送信されるため、1ページ分のみシリアライズされる）
+    """
+    columns = [NO_SELECTION] + list(df.columns)
+    c1, c2, c3, c4 = st.columns([3, 1, 3, 3])
+    sort_col = c1.selectbox("並び替え", columns, key=f"sort_col_{name}")
+    descending = c2.checkbox("降順", key=f"desc_{name}")
+    filter_col = c3.selectbox("絞り込み列", columns, key=f"filter_col_{name}")
+    query = c4.text_input("検索", key=f"query_{name}")
+
+    order = row_order(
+        name,
+        df,
+        sort_col=None if sort_col == NO_SELECTION else sort_col,
+        ascending=not descending,
+        filter_col=None if filter_col == NO_SELECTION else filter_col,
+        query=query,
+    )
+
+    total = len(order)
+    n_pages = max(1, math.ceil(total / page_size))
+    page_key = f"page_{name}"
+    params_key = f"preview_params_{name}"
+    params = (sort_col, descending, filter_col, query)
+    if st.session_state.get(params_key) != params:
+        # 並び替え・絞り込みが変わったら先頭ページに戻す
+        st.session_state[params_key] = params
+        st.session_state[page_key] = 1
+    elif st.session_state.get(page_key, 1) > n_pages:
+        st.session_state[page_key] = n_pages
+    page = st.number_input("ページ", min_value=1, max_value=n_pages, step=1, key=page_key)
+
+    start = (page - 1) * page_size
+    end = min(start + page_size, total)
+    st.dataframe(df.iloc[order[start:end]], use_container_width=True)
+    st.caption(f"{start + 1 if total else 0}–{end} / {total} 行（全 {len(df)} 行・{n_pages} ページ）")
@@ -1,37 +1,36 @@
 # tools.py
 from langchain_core.tools import tool
-import requests
+import csv
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import pandas as pd
 from io import StringIO
-import matplotlib.pyplot as plt
+from api_client import http_get, LRUCache
 
 load_dotenv()
 
-# ✅ OneDrive内のファイル名一覧を取得
-def get_file_list(access_token: str, folder_path="Test"):
+# ✅ OneDrive内のファイル一覧（Graph API の item そのまま）を取得
+def list_folder_items(access_token: str, folder_path="Test") -> list:
     url = f"https://graph.microsoft.com/v1.0/me/drive/root:/{folder_path}:/children"
     headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(url, headers=headers)
+    response = http_get(url, headers=headers)
 
     if response.status_code != 200:
         raise Exception(f"❌ OneDrive API エラー: {response.status_code} - {response.text}")
 
-    files = response.json().get("value", [])
-    return [item["name"] for item in files]
+    return response.json().get("value", [])
 
-# ✅ 指定ファイルを OneDrive から取得
-def fetch_onedrive_files(file_names: list, access_token: str, folder_path="Test") -> dict:
-    url = f"https://graph.microsoft.com/v1.0/me/drive/root:/{folder_path}:/children"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    res = requests.get(url, headers=headers)
+# ✅ OneDrive内のファイル名一覧を取得
+def get_file_list(access_token: str, folder_path="Test"):
+    return [item["name"] for item in list_folder_items(access_token, folder_path)]
 
-    if res.status_code != 200:
-        raise Exception(f"❌ OneDrive API エラー: {res.status_code} - {res.text}")
+# ✅ 指定ファイルを OneDrive から取得（スキーマがあればその文字コードでデコード）
+def fetch_onedrive_files(file_names: list, access_token: str, folder_path="Test",
+                         schemas: dict = None) -> dict:
+    schemas = schemas or {}
+    files = list_folder_items(access_token, folder_path)
 
     result = {}
-    files = res.json().get("value", [])
-
     for name in file_names:
         match = next((f for f in files if f["name"] == name), None)
         if not match:
@@ -39,83 +38,117 @@ def fetch_onedrive_files(file_names: list, access_token: str, folder_path="Test"
             continue
 
         download_url = match["@microsoft.graph.downloadUrl"]
-        content = requests.get(download_url).content.decode("utf-8", errors="ignore")
+        raw = http_get(download_url, api="download").content
+        content, _ = _decode(raw, schemas.get(name, {}).get("encoding"))
         result[name] = content
 
     return result
 
-# ✅ CSV文字列 → pandas DataFrameへ変換
-def convert_to_dataframes(file_contents: dict) -> dict:
-    dataframes = {}
+# =============================
+# スキーマ探索（HTTP Range で先頭だけ取得）
+# =============================
+PROBE_BYTES = 8192                            # 先頭から取得するバイト数
+PROBE_SAMPLE_ROWS = 5                         # サンプル行数
+PROBE_EXTENSIONS = (".csv", ".tsv", ".txt")   # 探索対象の拡張子
+PROBE_ENCODINGS = ("utf-8-sig", "cp932")      # 試行する文字コード（順番に）
+PROBE_MAX_WORKERS = 8                         # 同時に探索するファイル数
 
-    for filename, content in file_contents.items():
-        if isinstance(content, str) and content.startswith("⚠"):
-            dataframes[filename] = content
-            continue
+SCHEMA_CACHE_SIZE = 1000                      # スキーマキャッシュの最大件数
 
+_schema_cache = LRUCache(SCHEMA_CACHE_SIZE)  # eTag -> schema
+
+
+def _decode(raw: bytes, preferred: str = None) -> tuple:
+    """preferred → PROBE_ENCODINGS の順に試し、(テキスト, 文字コード) を返す"""
+    encodings = [preferred] if preferred else []
+    encodings += [e for e in PROBE_ENCODINGS if e != preferred]
+    for encoding in encodings:
         try:
-            dataframes[filename] = pd.read_csv(StringIO(content))
-        except Exception as e:
-            dataframes[filename] = f"❌ DataFrame変換失敗: {e}"
+            return raw.decode(encoding), encoding
+        except UnicodeDecodeError:
+            continue
+    return raw.decode("utf-8", errors="ignore"), "utf-8"
 
-    return dataframes
 
-# ✅ サブプロットで可視化s
-def visualization_subplots(dataframes: dict):
+def probe_file_schema(download_url: str, etag: str = None, max_bytes: int = PROBE_BYTES) -> dict:
     """
-    各DataFrameごとに「棒グラフ＋円グラフ＋ヒストグラム」を1行にまとめて表示する
-    layout = n_files × 3 のサブプロット
+    ダウンロードURLの先頭 max_bytes だけを Range リクエストで取得し、
+    列名・区切り文字・文字コード・サンプル行を返す（eTag ごとにキャッシュ）
     """
-    plt.rcParams['font.family'] = 'Hiragino Sans'
-
-    files = list(dataframes.keys())
-    n = len(files)
-
-    if n == 0:
-        return None
-
-    fig, axs = plt.subplots(n, 3, figsize=(15, 5 * n))
-    if n == 1:
-        axs = [axs]
-
-    for i, file in enumerate(files):
-        df = dataframes[file]
+    if etag:
+        cached = _schema_cache.get(etag)
+        if cached is not None:
+            return cached
+
+    # Range が無視されて 200 が返っても max_bytes までしか読まない
+    res = http_get(download_url, headers={"Range": f"bytes=0-{max_bytes - 1}"},
+                   api="download", max_bytes=max_bytes)
+    if res.status_code not in (200, 206):
+        return {"error": f"❌ 先頭取得エラー: {res.status_code}"}
+
+    raw = res.content
+    truncated = res.status_code == 206 or len(raw) >= max_bytes
+    if truncated and b"\n" in raw:
+        # 途中で切れた最終行（マルチバイト文字の途中を含む）は捨てる
+        raw = raw[:raw.rfind(b"\n") + 1]
+
+    text, encoding = _decode(raw)
+    try:
+        delimiter = csv.Sniffer().sniff(text, delimiters=",\t;|").delimiter
+    except csv.Error:
+        delimiter = ","
+
+    try:
+        sample = pd.read_csv(StringIO(text), sep=delimiter, nrows=PROBE_SAMPLE_ROWS)
+    except Exception as e:
+        return {"error": f"❌ スキーマ解析失敗: {e}"}
+
+    schema = {
+        "columns": [str(c) for c in sample.columns],
+        "delimiter": delimiter,
+        "encoding": encoding,
+        "sample_rows": sample.astype(str).to_dict(orient="records"),
+    }
+    if etag:
+        _schema_cache.set(etag, schema)
+    return schema
+
+
+def _probe_item(item: dict) -> dict:
+    name = item["name"]
+    download_url = item.get("@microsoft.graph.downloadUrl")
+    if not download_url or not name.lower().endswith(PROBE_EXTENSIONS):
+        return {"error": "⚠ 未対応の形式"}
+    try:
+        return probe_file_schema(download_url, etag=item.get("eTag"))
+    except Exception as e:
+        return {"error": f"❌ 先頭取得エラー: {e}"}
+
+
+# ✅ 一覧取得済みの各ファイルのスキーマを並列に取得（本体はダウンロードしない）
+def get_file_schemas(items: list) -> dict:
+    with ThreadPoolExecutor(max_workers=PROBE_MAX_WORKERS) as executor:
+        schemas = executor.map(_probe_item, items)
+        return {item["name"]: schema for item, schema in zip(items, schemas)}
+
+# ✅ CSV文字列 → pandas DataFrameへ変換（スキーマがあればその区切り文字で読む）
+def convert_to_dataframes(file_contents: dict, schemas: dict = None) -> dict:
+    schemas = schemas or {}
+    dataframes = {}
 
-        if isinstance(df, str):
-            for ax in axs[i]:
-                ax.set_title(f"{file} (Error)", fontsize=12)
-                ax.text(0.5, 0.5, df, ha='center', va='center')
+    for filename, content in file_contents.items():
+        if isinstance(content, str) and content.startswith("⚠"):
+            dataframes[filename] = content
             continue
 
-        # ✅ (1) セクター別含み損益
-        sector_profit = df.groupby("sector")["unrealized_profit"].sum()
-        sector_profit.plot(kind="bar", ax=axs[i][0])
-        axs[i][0].set_title(f"{file}：セクター別含み損益")
-        axs[i][0].set_xlabel("Sector")
-        axs[i][0].set_ylabel("Unrealized Profit")
-        axs[i][0].tick_params(axis='x', rotation=45)
-
-        # ✅ (2) 資産クラス別 保有評価額の円グラフ
-        try:
-            df["eval_value"] = df["quantity"] * df["price_per_unit"]
-            asset_value = df.groupby("asset_class")["eval_value"].sum()
-            asset_value.plot(kind="pie", ax=axs[i][1], autopct="%.1f%%")
-            axs[i][1].set_title(f"{file}：資産クラス比率")
-            axs[i][1].set_ylabel("")
-        except Exception:
-            axs[i][1].text(0.5, 0.5, "円グラフ描画不可", ha="center")
-
-        # ✅ (3) 取引数量ヒストグラム
+        delimiter = schemas.get(filename, {}).get("delimiter", ",")
         try:
-            df["quantity"].plot(kind="hist", bins=10, ax=axs[i][2])
-            axs[i][2].set_title(f"{file}：数量分布（ヒストグラム）")
-            axs[i][2].set_xlabel("Quantity")
-        except Exception:
-            axs[i][2].text(0.5, 0.5, "ヒストグラム描画不可", ha="center")
+            dataframes[filename] = pd.read_csv(StringIO(content), sep=delimiter)
+        except Exception as e:
+            dataframes[filename] = f"❌ DataFrame変換失敗: {e}"
 
-    plt.tight_layout()
-    return fig
+    return dataframes
 
 # ✅ 単体実行用
 if __name__ == "__main__":
-    print("⚠ このファイルは app.py から呼び出される想定です")
\ No newline at end of file
+    print("⚠ このファイルは app.py から呼び出される想定です")